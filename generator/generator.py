@@ -1,14 +1,53 @@
-import enum
+import functools
+import sys
 import typing
 
 
 NIL = 'nil'
 
+# Query without where and limit clauses
+_EMPTY_SELECT = 'SELECT * FROM data;'
 
-class Dialects(str, enum.Enum):
-    MYSQL = 'mysql'
-    POSTGRES = 'postgres'
-    SQLSERVER = 'sqlserver'
+# Dialects are compared as plain interned strings
+_MYSQL = sys.intern('mysql')
+_POSTGRES = sys.intern('postgres')
+_SQLSERVER = sys.intern('sqlserver')
+
+
+class Dialects:
+    """Supported dialects, values are plain strings accepted by `generate_sql`."""
+
+    MYSQL: typing.Final = _MYSQL
+    POSTGRES: typing.Final = _POSTGRES
+    SQLSERVER: typing.Final = _SQLSERVER
+
+
+_OPERATOR_CLAUSES = {
+    '=': 'IN',
+    '!=': 'NOT IN',
+    'is-empty': 'IS NULL',
+    'not-empty': 'IS NOT NULL',
+}
+
+# Separators of operands of conjunction and disjunction
+_CONJUNCTIONS = {
+    'and': ' AND ',
+    'or': ' OR ',
+}
+
+# Opening quote, closing quote and translation table escaping quotes inside identifier
+_IDENTIFIER_FORMATS = {
+    _MYSQL: ('`', '`', str.maketrans({'`': '``'})),
+    _POSTGRES: ('"', '"', str.maketrans({'"': '""'})),
+    _SQLSERVER: ('"', '"', str.maketrans({'"': '""'})),
+}
+_DEFAULT_IDENTIFIER_FORMAT = _IDENTIFIER_FORMATS[_POSTGRES]
+
+# Preformatted integers, which are common in queries as IDs, ages, etc.
+_INT_LITERALS = {number: str(number) for number in range(-128, 1024)}
+
+# Op of compiled where clause: strings are emitted as is, integers are IDs of fields
+_Op = typing.Union[str, int]
 
 
 class IncorrectFieldFormat(Exception):
@@ -26,167 +65,449 @@ class OperatorDoesNotExist(Exception):
     """Raised when operator does not exist."""
 
 
-def _is_correct_field(arg: list):
-    return len(arg) == 2 and arg[0] == 'field' and isinstance(arg[1], int)
+def _is_correct_field(arg: tuple[typing.Any, ...]) -> bool:
+    if len(arg) != 2:
+        return False
 
+    tag, field_id = arg
+    # Exact class check is cheaper than isinstance and also rejects bool IDs
+    return tag == 'field' and field_id.__class__ is int
 
-def _operator_to_clause(operator: str) -> str:
-    if operator == '=':
-        return 'IN'
-    elif operator == '!=':
-        return 'NOT IN'
-    elif operator == 'is-empty':
-        return 'IS NULL'
-    elif operator == 'not-empty':
-        return 'IS NOT NULL'
-
-    raise OperatorDoesNotExist(f'Operator {operator} does not exist')
 
+def _operator_to_clause(operator: str) -> str:
+    try:
+        return _OPERATOR_CLAUSES[operator]
+    except KeyError:
+        raise OperatorDoesNotExist(f'Operator {operator} does not exist') from None
 
-def _surround_clause(clause: str) -> str:
-    return f'({clause})'
 
+def _surround_identifier(name: str, dialect: str) -> str:
+    left, right, escapes = _IDENTIFIER_FORMATS.get(dialect, _DEFAULT_IDENTIFIER_FORMAT)
+    return left + name.translate(escapes) + right
 
-def _surround_identifier(name: str, dialect: str):
-    if dialect == Dialects.MYSQL:
-        return f'`{name}`'
-    else:
-        return f'"{name}"'
 
+def _extract_field(arg: typing.Any) -> _Op:
+    """Return argument as literal or ID of referenced field.
 
-def _extract_field(arg, fields: dict[int, str], dialect: str) -> str:
-    """Return argument as literal or field in correct format."""
+    Field IDs are replaced with quoted field names when compiled query is rendered.
+    """
 
     # arg is reference to Field
-    if isinstance(arg, list):
+    if isinstance(arg, tuple):
         if not _is_correct_field(arg):
             raise IncorrectFieldFormat(f'Field data: {arg}')
 
-        field_id = arg[1]
-
-        if field_id not in fields:
-            raise FieldDoesNotExist(f'Field with ID {field_id} does not exist')
+        return arg[1]
 
-        return _surround_identifier(fields[field_id], dialect)
+    # arg is literal, common types are emitted without intermediate str() call
+    if arg.__class__ is int:
+        literal = _INT_LITERALS.get(arg)
+        return literal if literal is not None else str(arg)
 
-    # arg is literal
-    else:
-        result = str(arg)
-        if arg != NIL and isinstance(arg, str):
-            result = f'\'{arg}\''
+    if isinstance(arg, str):
+        return arg if arg == NIL else '\'' + arg + '\''
 
-        return result
+    return str(arg)
 
 
-def _build_comparison_clause(
-    operator: str,
-    left_arg,
-    right_arg,
-    fields: dict[int, str],
-    dialect: str,
-) -> str:
+def _build_comparison_clause(operator: str, left_arg: typing.Any, right_arg: typing.Any) -> list[_Op]:
     """Build binary clause.
 
     :param operator: can be one of =, !=, <, >
     """
 
-    left = _extract_field(left_arg, fields, dialect)
-    right = _extract_field(right_arg, fields, dialect)
+    # If either left arg or right arg is nil, then build null clause
+    left = _extract_field(left_arg)
+    if left == NIL:
+        return _build_null_clause('is-empty' if operator == '=' else 'not-empty', right_arg)
 
-    if NIL not in (left, right):
-        return f'{left} {operator} {right}'
+    right = _extract_field(right_arg)
+    if right == NIL:
+        return _build_null_clause('is-empty' if operator == '=' else 'not-empty', left_arg)
 
-    # If either left arg or right arg is nil, then build null clause
-    not_nil_arg = left_arg if left != NIL else right_arg
-    new_operator = 'is-empty' if operator == '=' else 'not-empty'
-    return _build_null_clause(new_operator, not_nil_arg, fields, dialect)
+    return [left, ' ' + operator + ' ', right]
 
 
-def _build_in_clause(operator: str, args: list, fields: dict[int, str], dialect: str) -> str:
-    """Build IN or NOT in clause."""
+def _in_literal_key(arg: typing.Any) -> tuple[typing.Any, typing.Any]:
+    """Return cache key of IN clause argument, validating field references.
+
+    Field reference is keyed by its validated ID, so incorrect references are never served
+    from cache. Literal is keyed by `_literal_key`, whose second item is already final op.
+    """
+
+    if isinstance(arg, tuple):
+        if not _is_correct_field(arg):
+            raise IncorrectFieldFormat(f'Field data: {arg}')
+
+        return tuple, arg[1]
+
+    return _literal_key(arg)
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_in_literals(literals: tuple[tuple[typing.Any, typing.Any], ...]) -> tuple[_Op, ...]:
+    """Build parenthesized list of IN clause arguments.
+
+    Cached, because same lists of literals tend to be repeated across queries.
+
+    :param literals: keys of arguments built by `_in_literal_key`
+    """
+
+    clause: list[_Op] = ['(']
 
-    head_field = _extract_field(args[0], fields, dialect)
-    tail_fields = [
-        _extract_field(arg, fields, dialect)
-        for arg in args[1:]
-    ]
-    args_clause = _surround_clause(', '.join(tail_fields))
-    in_clause = _operator_to_clause(operator)
+    for index, (_, value) in enumerate(literals):
+        if index:
+            clause.append(', ')
 
-    return f'{head_field} {in_clause} {args_clause}'
+        clause.append(value)
 
+    clause.append(')')
+    return tuple(clause)
 
-def _build_null_clause(operator: str, arg, fields: dict[int, str], dialect: str) -> str:
+
+def _build_in_clause(operator: str, args: tuple[typing.Any, ...]) -> list[_Op]:
+    """Build IN or NOT in clause."""
+
+    # Keys hold only types, field IDs and rendered text, so they are always hashable
+    in_literals = _format_in_literals(tuple(_in_literal_key(arg) for arg in args[1:]))
+    return [_extract_field(args[0]), ' ' + _operator_to_clause(operator) + ' ', *in_literals]
+
+
+def _build_null_clause(operator: str, arg: typing.Any) -> list[_Op]:
     """Build IS NULL or IS NOT NULL clause."""
 
-    field = _extract_field(arg, fields, dialect)
-    null_clause = _operator_to_clause(operator)
+    return [_extract_field(arg), ' ' + _operator_to_clause(operator)]
+
+
+def _build_comparison_node(operator: str, operands: tuple[typing.Any, ...]) -> list[_Op]:
+    return _build_comparison_clause(operator, operands[0], operands[1])
+
+
+def _build_equality_node(operator: str, operands: tuple[typing.Any, ...]) -> list[_Op]:
+    if len(operands) == 2:
+        # If there are two operands, then use equality clause
+        return _build_comparison_clause(operator, operands[0], operands[1])
+
+    # Otherwise, use IN clause
+    return _build_in_clause(operator, operands)
+
+
+def _build_null_node(operator: str, operands: tuple[typing.Any, ...]) -> list[_Op]:
+    return _build_null_clause(operator, operands[0])
+
+
+# Builders of clauses for operators which do not contain nested clauses
+_LEAF_BUILDERS: dict[str, typing.Callable[[str, tuple[typing.Any, ...]], list[_Op]]] = {
+    '<': _build_comparison_node,
+    '>': _build_comparison_node,
+    '=': _build_equality_node,
+    '!=': _build_equality_node,
+    'is-empty': _build_null_node,
+    'not-empty': _build_null_node,
+}
+
+
+def _unwrap_clause(node: typing.Any) -> typing.Any:
+    """Return operand of conjunction or disjunction of single operand, which adds nothing to it."""
+
+    while node[0] in _CONJUNCTIONS and len(node) == 2:
+        node = node[1]
 
-    return f'{field} {null_clause}'
+    return node
 
 
-def _build_where_clause(dialect: str, fields: dict[int, str], query: typing.Optional[list]) -> str:
+def _push_operand(work: list[tuple[typing.Any, bool]], node: typing.Any) -> None:
+    """Push operand of AND, OR or NOT to `work`, surrounding it only if it is not atomic.
+
+    Clauses are atomic unless they combine several operands with AND or OR: comparisons
+    bind tighter than NOT, AND and OR, and NOT binds tighter than AND and OR.
+    """
+
+    node = _unwrap_clause(node)
+
+    if node[0] in _CONJUNCTIONS and len(node) > 2:
+        work.extend(((')', True), (node, False), ('(', True)))
+    else:
+        work.append((node, False))
+
+
+def _build_where_iter(query: typing.Optional[tuple[typing.Any, ...]]) -> list[_Op]:
+    """Build where clause walking query with explicit stack instead of recursion.
+
+    Clause is returned as list of ops: strings are emitted as is, integers are IDs of fields.
+    Only operands which are not atomic are surrounded by parentheses, see `_push_operand`.
+
+    Stack `work` holds (item, is_op) pairs: ops are emitted as is, other items are nodes of query
+    which are not built yet. All ops are emitted into single list in order, so built clauses
+    are never copied into parent ones.
+    """
+
     if query is None:
-        return ''
-
-    operator = query[0]
-    operands = query[1:]
-
-    if operator in ('and', 'or'):
-        clause_parts = []
-        operator = f' {operator.upper()} '
-
-        # If there is only one operand, ignore operator
-        if len(operands) == 1:
-            return _surround_clause(_build_where_clause(dialect, fields, operands[1]))
-
-        for clause in operands:
-            clause_parts.append(_build_where_clause(dialect, fields, clause))
-
-        result_clause = operator.join(clause_parts)
-    elif operator == 'not':
-        result_clause = 'NOT ' + _build_where_clause(dialect, fields, operands[0])
-    elif operator in ('<', '>'):
-        result_clause = _build_comparison_clause(operator, operands[0], operands[1], fields, dialect)
-    elif operator in ('=', '!='):
-        if len(operands) == 2:
-            # If there are two operands, then use equality clause
-            result_clause = _build_comparison_clause(operator, operands[0], operands[1], fields, dialect)
+        return []
+
+    # Whole where clause is never surrounded
+    work: list[tuple[typing.Any, bool]] = [(_unwrap_clause(query), False)]
+    out: list[_Op] = []
+
+    while work:
+        node, is_op = work.pop()
+
+        if is_op:
+            out.append(node)
+            continue
+
+        operator = node[0]
+        operands = node[1:]
+
+        # Leaf clauses are most common, so their builders are looked up first
+        builder = _LEAF_BUILDERS.get(operator)
+        if builder is not None:
+            out.extend(builder(operator, operands))
+            continue
+
+        separator = _CONJUNCTIONS.get(operator)
+        if separator is not None:
+            if not operands:
+                out.append('()')
+                continue
+
+            for index, clause in enumerate(reversed(operands)):
+                if index:
+                    work.append((separator, True))
+                _push_operand(work, clause)
+        elif operator == 'not':
+            _push_operand(work, operands[0])
+            work.append(('NOT ', True))
         else:
-            # Otherwise, use IN clause
-            result_clause = _build_in_clause(operator, operands, fields, dialect)
-    elif operator in ('is-empty', 'not-empty'):
-        result_clause = _build_null_clause(operator, operands[0], fields, dialect)
-    else:
-        raise OperatorDoesNotExist(operator)
+            raise OperatorDoesNotExist(operator)
 
-    return _surround_clause(result_clause)
+    # Join adjacent strings, so rendering touches as few ops as possible
+    ops: list[_Op] = []
+    strings: list[str] = []
+    for op in out:
+        if isinstance(op, str):
+            strings.append(op)
+            continue
 
+        if strings:
+            ops.append(''.join(strings))
+            strings.clear()
+        ops.append(op)
 
-def _build_limit_clause(dialect: str, limit: typing.Optional[int]) -> str:
-    """Build limit clause according to dialect."""
+    if strings:
+        ops.append(''.join(strings))
 
-    if limit is None:
-        return ''
+    return ops
 
-    if dialect == Dialects.SQLSERVER:
-        return f'TOP({limit})'
-    else:
-        return f'LIMIT {limit}'
 
+def _literal_key(value: typing.Any) -> tuple[typing.Any, _Op]:
+    """Return cache key part telling apart equal scalar values which are rendered differently.
 
-def generate_sql(dialect: str, fields: dict[int, str], query: dict) -> str:
-    where_clause = _build_where_clause(dialect, fields, query.get('where'))
-    limit_clause = _build_limit_clause(dialect, query.get('limit'))
+    Values like 1, 1.0 and True or Decimal('1.0') and Decimal('1.00') are equal, so they are
+    keyed by their type and rendered text.
+    """
 
-    if where_clause != '':
-        where_clause = 'WHERE ' + where_clause
+    return value.__class__, _extract_field(value)
 
-    if dialect == Dialects.SQLSERVER:
-        query_parts = ['SELECT', limit_clause, '* FROM data', where_clause]
-    else:
-        query_parts = ['SELECT * FROM data', where_clause, limit_clause]
 
-    # Remove extra spaces in query
-    query = ' '.join(part for part in query_parts if part.strip()) + ';'
-    return query
+def _freeze(value: typing.Any) -> typing.Any:
+    """Return hashable copy of query: lists become tuples, dicts become tuples of sorted items.
+
+    Uses the same explicit stack walk as `_build_where_iter`, so deeply nested queries are supported.
+    """
+
+    work: list[tuple[typing.Any, typing.Optional[int]]] = [(value, None)]
+    out: list[typing.Any] = []
+
+    while work:
+        item, size = work.pop()
+
+        if size is not None:
+            frozen = tuple(out[len(out) - size:])
+            del out[len(out) - size:]
+
+            if isinstance(item, dict):
+                frozen = tuple(sorted(zip(item, frozen)))
+
+            out.append(frozen)
+        elif isinstance(item, (list, tuple, dict)):
+            children = list(item.values()) if isinstance(item, dict) else item
+            work.append((item, len(children)))
+            work.extend((child, None) for child in reversed(children))
+        else:
+            out.append(item)
+
+    return out[0]
+
+
+def _flatten(value: typing.Any) -> tuple[typing.Any, ...]:
+    """Return query as flat tuple of tokens, which is used as cache key.
+
+    Nested tuples can not be used as key of deep query: comparing and hashing them recurses.
+    Lists and tuples become '(' and ')' tokens around their items, scalar values become
+    (`_literal_key`, value) pairs, so they never clash with brackets.
+    """
+
+    work: list[tuple[typing.Any, bool]] = [(value, False)]
+    tokens: list[typing.Any] = []
+
+    while work:
+        item, is_bracket = work.pop()
+
+        if is_bracket:
+            tokens.append(item)
+        elif isinstance(item, (list, tuple)):
+            tokens.append('(')
+            work.append((')', True))
+            work.extend((child, False) for child in reversed(item))
+        else:
+            tokens.append((_literal_key(item), item))
+
+    return tuple(tokens)
+
+
+def _unflatten(tokens: tuple[typing.Any, ...]) -> typing.Any:
+    """Return frozen query from tokens built by `_flatten`."""
+
+    stack: list[list[typing.Any]] = [[]]
+
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            items = stack.pop()
+            stack[-1].append(tuple(items))
+        else:
+            stack[-1].append(token[1])
+
+    return stack[0][0]
+
+
+def _build_select_with_top(where_clause: str, limit: typing.Any) -> str:
+    """Build SELECT statement for SQL Server, which limits rows with TOP before selected columns."""
+
+    sql = 'SELECT'
+    if limit is not None:
+        sql += f' TOP({limit})'
+    sql += ' * FROM data'
+    if where_clause:
+        sql += ' WHERE ' + where_clause
+
+    return sql + ';'
+
+
+def _build_select_with_limit(where_clause: str, limit: typing.Any) -> str:
+    """Build SELECT statement for dialects which limit rows with LIMIT clause."""
+
+    sql = 'SELECT * FROM data'
+    if where_clause:
+        sql += ' WHERE ' + where_clause
+    if limit is not None:
+        sql += f' LIMIT {limit}'
+
+    return sql + ';'
+
+
+# Builders of SELECT statement specialized for dialect, so rendering does not check dialect
+_SELECT_BUILDERS: dict[str, typing.Callable[[str, typing.Any], str]] = {
+    _SQLSERVER: _build_select_with_top,
+}
+
+
+def _get_select_builder(dialect: str) -> typing.Callable[[str, typing.Any], str]:
+    return _SELECT_BUILDERS.get(dialect, _build_select_with_limit)
+
+
+def _render(
+    ops: list[_Op],
+    limit: typing.Any,
+    quoted_fields: dict[int, str],
+    build_select: typing.Callable[[str, typing.Any], str],
+) -> str:
+    """Render compiled where clause and limit to SQL.
+
+    :param quoted_fields: field names surrounded with identifier quotes of dialect, by field ID
+    """
+
+    where_parts: list[str] = []
+    for op in ops:
+        if isinstance(op, str):
+            where_parts.append(op)
+            continue
+
+        try:
+            where_parts.append(quoted_fields[op])
+        except KeyError:
+            raise FieldDoesNotExist(f'Field with ID {op} does not exist') from None
+
+    return build_select(''.join(where_parts), limit)
+
+
+def _compile_query(
+    where: typing.Optional[tuple[typing.Any, ...]],
+    limit: typing.Any,
+) -> typing.Callable[[str, dict[int, str]], str]:
+    """Compile frozen where clause and limit, see `compile_query`."""
+
+    ops = _build_where_iter(where)
+
+    def render(dialect: str, fields: dict[int, str]) -> str:
+        quoted_fields = {field_id: _surround_identifier(name, dialect) for field_id, name in fields.items()}
+        return _render(ops, limit, quoted_fields, _get_select_builder(dialect))
+
+    return render
+
+
+def compile_query(query: dict[str, typing.Any]) -> typing.Callable[[str, dict[int, str]], str]:
+    """Walk query once and return function which renders it to SQL.
+
+    Returned function accepts dialect and fields, so same query can be rendered
+    for different dialects and fields without walking it again.
+
+    Where clause is converted to tuples once here, so rest of generator never deals with lists.
+    """
+
+    return _compile_query(_freeze(query.get('where')), query.get('limit'))
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
+def _generate_sql_cached(
+    dialect: str,
+    fields_items: tuple[tuple[int, str], ...],
+    where_tokens: tuple[typing.Any, ...],
+    limit: typing.Any,
+    limit_key: typing.Any,
+) -> str:
+    # limit_key is not used for rendering, it is only part of cache key
+    return _compile_query(_unflatten(where_tokens), limit)(dialect, dict(fields_items))
+
+
+def generate_sql(dialect: str, fields: dict[int, str], query: dict[str, typing.Any]) -> str:
+    if not query:
+        return _EMPTY_SELECT
+
+    where = query.get('where')
+    limit = query.get('limit')
+
+    # Queries without where clause do not depend on fields, so they are built without cache
+    if where is None:
+        if limit is None:
+            return _EMPTY_SELECT
+
+        return _get_select_builder(dialect)('', limit)
+
+    try:
+        key = (dialect, tuple(sorted(fields.items())), _flatten(where), limit, _literal_key(limit))
+        hash(key)
+    except TypeError:
+        # Query contains unhashable values, so it can not be cached
+        return compile_query(query)(dialect, fields)
+
+    return _generate_sql_cached(*key)
+
+
+def clear_cache() -> None:
+    """Clear caches of generated queries and IN clause arguments."""
+
+    _generate_sql_cached.cache_clear()
+    _format_in_literals.cache_clear()
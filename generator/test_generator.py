@@ -1,3 +1,4 @@
+import decimal
 import unittest
 
 from . import generator
@@ -24,7 +25,7 @@ class TestGenerateSQL(unittest.TestCase):
         query = {
             'where': ['=', ['field', 2], 'cam'],
         }
-        expected_query = "SELECT * FROM data WHERE (\"name\" = 'cam');"
+        expected_query = "SELECT * FROM data WHERE \"name\" = 'cam';"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -33,7 +34,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_when_comparing_field_with_nil(self):
         query = {'where': ['=', ['field', 3], 'nil']}
-        expected_query = "SELECT * FROM data WHERE (\"date_joined\" IS NULL);"
+        expected_query = "SELECT * FROM data WHERE \"date_joined\" IS NULL;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -42,7 +43,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_when_comparing_field_with_integer(self):
         query = {'where': [">", ["field", 4], 35]}
-        expected_query = "SELECT * FROM data WHERE (\"age\" > 35);"
+        expected_query = "SELECT * FROM data WHERE \"age\" > 35;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -51,7 +52,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_when_comparing_multiple_comparisons_and_conjunction(self):
         query = {"where": ["and", ["<", ["field", 1], 5], ["=", ["field", 2], "joe"]]}
-        expected_query = "SELECT * FROM data WHERE ((\"id\" < 5) AND (\"name\" = 'joe'));"
+        expected_query = "SELECT * FROM data WHERE \"id\" < 5 AND \"name\" = 'joe';"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -60,7 +61,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_when_comparing_multiple_comparisons_and_disjunction(self):
         query = {"where": ["or", ["!=", ["field", 3], "2015-11-01"], ["=", ["field", 1], 456]]}
-        expected_query = "SELECT * FROM data WHERE ((\"date_joined\" != '2015-11-01') OR (\"id\" = 456));"
+        expected_query = "SELECT * FROM data WHERE \"date_joined\" != '2015-11-01' OR \"id\" = 456;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -77,8 +78,8 @@ class TestGenerateSQL(unittest.TestCase):
                 ],
         }
         expected_query = (
-            "SELECT * FROM data WHERE ((\"date_joined\" IS NOT NULL) "
-            "AND ((\"age\" > 25) OR (\"name\" = 'Jerry')));"
+            "SELECT * FROM data WHERE \"date_joined\" IS NOT NULL "
+            "AND (\"age\" > 25 OR \"name\" = 'Jerry');"
         )
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -87,7 +88,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_in_operator(self):
         query = {"where": ["=", ["field", 4], 25, 26, 27]}
-        expected_query = "SELECT * FROM data WHERE (\"age\" IN (25, 26, 27));"
+        expected_query = "SELECT * FROM data WHERE \"age\" IN (25, 26, 27);"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -96,7 +97,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_limit_for_mysql(self):
         query = {"where": ["=", ["field", 2], "cam"], "limit": 10}
-        expected_query = "SELECT * FROM data WHERE (`name` = 'cam') LIMIT 10;"
+        expected_query = "SELECT * FROM data WHERE `name` = 'cam' LIMIT 10;"
 
         self.assertEqual(
             generator.generate_sql('mysql', self.fields, query),
@@ -123,7 +124,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_is_empty_operator(self):
         query = {"where": ["is-empty", ["field", 4]]}
-        expected_query = "SELECT * FROM data WHERE (\"age\" IS NULL);"
+        expected_query = "SELECT * FROM data WHERE \"age\" IS NULL;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -132,7 +133,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_not_empty_operator(self):
         query = {"where": ["not-empty", ["field", 4]]}
-        expected_query = "SELECT * FROM data WHERE (\"age\" IS NOT NULL);"
+        expected_query = "SELECT * FROM data WHERE \"age\" IS NOT NULL;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -141,7 +142,7 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_not_operator(self):
         query = {"where": ["not", ["=", ["field", 4], 25]]}
-        expected_query = "SELECT * FROM data WHERE (NOT (\"age\" = 25));"
+        expected_query = "SELECT * FROM data WHERE NOT \"age\" = 25;"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
@@ -150,9 +151,226 @@ class TestGenerateSQL(unittest.TestCase):
 
     def test_generate_sql_with_nested_not_operator(self):
         query = {"where": ["not", ["and", ["not", ["<", ["field", 1], 5]], ["=", ["field", 2], "joe"]]]}
-        expected_query = "SELECT * FROM data WHERE (NOT ((NOT (\"id\" < 5)) AND (\"name\" = 'joe')));"
+        expected_query = "SELECT * FROM data WHERE NOT (NOT \"id\" < 5 AND \"name\" = 'joe');"
 
         self.assertEqual(
             generator.generate_sql('postgres', self.fields, query),
             expected_query,
         )
+
+    def test_generate_sql_with_deeply_nested_conjunction(self):
+        where = ["=", ["field", 1], 5]
+        expected_where = "\"id\" = 5"
+        for depth in range(2000):
+            where = ["and", where, ["=", ["field", 2], "joe"]]
+            if depth:
+                expected_where = "(" + expected_where + ")"
+            expected_where += " AND \"name\" = 'joe'"
+        query = {"where": where}
+        expected_query = "SELECT * FROM data WHERE " + expected_where + ";"
+
+        # Second call is served from cache
+        generator.clear_cache()
+        for _ in range(2):
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, query),
+                expected_query,
+            )
+
+    def test_generate_sql_returns_cached_query_for_same_input(self):
+        generator.clear_cache()
+        query = {"where": ["=", ["field", 4], 25, 26, 27], "limit": 5}
+        expected_query = "SELECT * FROM data WHERE \"age\" IN (25, 26, 27) LIMIT 5;"
+
+        for _ in range(2):
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, query),
+                expected_query,
+            )
+
+        cache_info = generator._generate_sql_cached.cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses), (1, 1))
+
+    def test_generate_sql_does_not_share_cache_between_fields(self):
+        query = {"where": ["=", ["field", 1], 5]}
+
+        self.assertEqual(
+            generator.generate_sql('postgres', {1: 'id'}, query),
+            "SELECT * FROM data WHERE \"id\" = 5;",
+        )
+        self.assertEqual(
+            generator.generate_sql('postgres', {1: 'user_id'}, query),
+            "SELECT * FROM data WHERE \"user_id\" = 5;",
+        )
+
+    def test_generate_sql_with_incorrect_field_format(self):
+        for where in (
+            ["=", ["field", 1, 2], 5],
+            ["=", ["column", 1], 5],
+            ["=", ["field", "1"], 5],
+            ["=", ["field", True], 5],
+        ):
+            with self.assertRaises(generator.IncorrectFieldFormat, msg=f'where is {where}'):
+                generator.generate_sql('postgres', self.fields, {"where": where})
+
+    def test_compile_query_renders_for_different_dialects_and_fields(self):
+        render = generator.compile_query({"where": ["=", ["field", 2], "cam"], "limit": 10})
+
+        self.assertEqual(
+            render('mysql', self.fields),
+            "SELECT * FROM data WHERE `name` = 'cam' LIMIT 10;",
+        )
+        self.assertEqual(
+            render('sqlserver', {2: 'nickname'}),
+            "SELECT TOP(10) * FROM data WHERE \"nickname\" = 'cam';",
+        )
+
+    def test_compile_query_with_field_which_does_not_exist(self):
+        render = generator.compile_query({"where": ["=", ["field", 5], 25]})
+
+        with self.assertRaises(generator.FieldDoesNotExist):
+            render('postgres', self.fields)
+
+    def test_generate_sql_with_in_operator_and_equal_literals_of_different_types(self):
+        generator.clear_cache()
+
+        self.assertEqual(
+            generator.generate_sql('postgres', self.fields, {"where": ["=", ["field", 4], 1, 2]}),
+            "SELECT * FROM data WHERE \"age\" IN (1, 2);",
+        )
+        self.assertEqual(
+            generator.generate_sql('postgres', self.fields, {"where": ["=", ["field", 4], 1.0, 2.0]}),
+            "SELECT * FROM data WHERE \"age\" IN (1.0, 2.0);",
+        )
+
+    def test_compile_query_with_in_operator_validates_cached_field_references(self):
+        generator.clear_cache()
+        render = generator.compile_query({"where": ["=", ["field", 4], 5, ["field", 1]]})
+        self.assertEqual(render('postgres', self.fields), "SELECT * FROM data WHERE \"age\" IN (5, \"id\");")
+
+        for field_id in (True, 1.0):
+            with self.assertRaises(generator.IncorrectFieldFormat, msg=f'field_id is {field_id}'):
+                generator.compile_query({"where": ["=", ["field", 4], 5, ["field", field_id]]})
+
+    def test_compile_query_with_in_operator_and_zero_literals(self):
+        generator.clear_cache()
+
+        self.assertEqual(
+            generator.compile_query({"where": ["=", ["field", 4], 0.0, 1]})('postgres', self.fields),
+            "SELECT * FROM data WHERE \"age\" IN (0.0, 1);",
+        )
+        self.assertEqual(
+            generator.compile_query({"where": ["=", ["field", 4], -0.0, 1]})('postgres', self.fields),
+            "SELECT * FROM data WHERE \"age\" IN (-0.0, 1);",
+        )
+
+    def test_in_clause_does_not_share_cache_between_equal_decimals(self):
+        generator.clear_cache()
+
+        for literal in ('1.0', '1.00'):
+            self.assertEqual(
+                generator.compile_query(
+                    {"where": ["=", ["field", 4], decimal.Decimal(literal), 2]},
+                )('postgres', self.fields),
+                f"SELECT * FROM data WHERE \"age\" IN ({literal}, 2);",
+            )
+
+    def test_in_clause_with_unhashable_literal(self):
+        generator.clear_cache()
+
+        for _ in range(2):
+            self.assertEqual(
+                generator.compile_query({"where": ["=", ["field", 4], {1, 2}, 3]})('postgres', self.fields),
+                "SELECT * FROM data WHERE \"age\" IN ({1, 2}, 3);",
+            )
+
+    def test_generate_sql_with_unhashable_literal_is_not_cached(self):
+        generator.clear_cache()
+
+        for _ in range(2):
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, {"where": ["=", ["field", 4], {1, 2}]}),
+                "SELECT * FROM data WHERE \"age\" = {1, 2};",
+            )
+
+        self.assertEqual(generator._generate_sql_cached.cache_info().currsize, 0)
+
+    def test_generate_sql_does_not_share_cache_between_zero_and_negative_zero(self):
+        generator.clear_cache()
+
+        for literal, expected_literal in ((0.0, '0.0'), (-0.0, '-0.0')):
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, {"where": ["=", ["field", 4], literal]}),
+                f"SELECT * FROM data WHERE \"age\" = {expected_literal};",
+            )
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, {"limit": literal, "where": ["=", ["field", 4], 1]}),
+                f"SELECT * FROM data WHERE \"age\" = 1 LIMIT {expected_literal};",
+            )
+
+    def test_generate_sql_does_not_share_cache_between_equal_decimals(self):
+        generator.clear_cache()
+
+        for literal in ('1.0', '1.00'):
+            self.assertEqual(
+                generator.generate_sql('postgres', self.fields, {"where": ["=", ["field", 4], decimal.Decimal(literal)]}),
+                f"SELECT * FROM data WHERE \"age\" = {literal};",
+            )
+
+    def test_generate_sql_with_single_operand_conjunction(self):
+        query = {"where": ["or", ["=", ["field", 2], "joe"]]}
+        expected_query = "SELECT * FROM data WHERE \"name\" = 'joe';"
+
+        self.assertEqual(
+            generator.generate_sql('postgres', self.fields, query),
+            expected_query,
+        )
+
+    def test_generate_sql_surrounds_only_combined_operands(self):
+        query = {
+            "where": [
+                "or",
+                ["and", ["or", ["=", ["field", 1], 1], ["=", ["field", 1], 2]]],
+                ["not", ["or", ["<", ["field", 4], 18]]],
+            ],
+        }
+        expected_query = "SELECT * FROM data WHERE (\"id\" = 1 OR \"id\" = 2) OR NOT \"age\" < 18;"
+
+        self.assertEqual(
+            generator.generate_sql('postgres', self.fields, query),
+            expected_query,
+        )
+
+    def test_generate_sql_escapes_quotes_in_field_names(self):
+        fields = {1: 'my`field', 2: 'my"field'}
+        query = {"where": ["and", ["=", ["field", 1], 5], ["=", ["field", 2], 6]]}
+
+        self.assertEqual(
+            generator.generate_sql('mysql', fields, query),
+            "SELECT * FROM data WHERE `my``field` = 5 AND `my\"field` = 6;",
+        )
+        self.assertEqual(
+            generator.generate_sql('postgres', fields, query),
+            "SELECT * FROM data WHERE \"my`field\" = 5 AND \"my\"\"field\" = 6;",
+        )
+
+    def test_generate_sql_with_literals_of_different_types(self):
+        query = {"where": ["=", ["field", 4], 5, 5000, -1, 2.5, True, "nil", "x"]}
+        expected_query = "SELECT * FROM data WHERE \"age\" IN (5, 5000, -1, 2.5, True, nil, 'x');"
+
+        self.assertEqual(
+            generator.generate_sql('postgres', self.fields, query),
+            expected_query,
+        )
+
+    def test_generate_sql_with_dialect_constants(self):
+        query = {"where": ["=", ["field", 2], "cam"], "limit": 10}
+
+        self.assertEqual(
+            generator.generate_sql(generator.Dialects.MYSQL, self.fields, query),
+            "SELECT * FROM data WHERE `name` = 'cam' LIMIT 10;",
+        )
+        self.assertEqual(
+            generator.generate_sql(generator.Dialects.SQLSERVER, self.fields, query),
+            "SELECT TOP(10) * FROM data WHERE \"name\" = 'cam';",
+        )